@@ -1,28 +1,25 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import time
 import random
 import altair as alt
 import os
+import json
+import math
+from typing import NamedTuple
 
 # --- 1. Page Configuration ---
 st.set_page_config(page_title="Greenhouse Gas Lab", layout="wide")
 
-# --- 2. Styles for Big Meters & Layout ---
-st.markdown("""
+# --- 2. Styles for Labels & Particle View ---
+@st.cache_resource
+def style_block():
+    """
+    Page CSS, built once per server process instead of once per rerun.
+    """
+    return """
 <style>
-    .big-font {
-        font-size:50px !important;
-        font-weight: bold;
-        color: #333;
-    }
-    .metric-container {
-        background-color: #f0f2f6;
-        padding: 20px;
-        border-radius: 10px;
-        text-align: center;
-        border: 1px solid #d6d6d6;
-    }
     .label-font {
         font-size: 20px;
         color: #555;
@@ -33,22 +30,51 @@ st.markdown("""
         background-color: #fff;
         margin-top: 10px;
     }
+    /* Particle vibration: speed comes from the --vib variable, set per frame */
+    .particle-box circle {
+        animation-duration: var(--vib, 1s);
+        animation-timing-function: linear;
+        animation-iteration-count: infinite;
+    }
+    .jiggle-pp { animation-name: jiggle-pp; }
+    .jiggle-pn { animation-name: jiggle-pn; }
+    .jiggle-np { animation-name: jiggle-np; }
+    .jiggle-nn { animation-name: jiggle-nn; }
+    @keyframes jiggle-pp { 50% { transform: translate(5px, 5px); } }
+    @keyframes jiggle-pn { 50% { transform: translate(5px, -5px); } }
+    @keyframes jiggle-np { 50% { transform: translate(-5px, 5px); } }
+    @keyframes jiggle-nn { 50% { transform: translate(-5px, -5px); } }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def label_html(text):
+    return f'<div class="label-font">{text}</div>'
+
+st.markdown(style_block(), unsafe_allow_html=True)
 
 # --- 3. Physics & State Management ---
 
+# Simulation Clock: a run lasts RUN_MINUTES, in TIME_STEP minute steps
+RUN_MINUTES = 20.0
+TIME_STEP = 0.1
+RUN_SLOTS = round(RUN_MINUTES / TIME_STEP) + 1  # one per step, plus t=0
+
 # Initialize Session State variables
 if 'is_running' not in st.session_state:
     st.session_state.is_running = False
-if 'current_time' not in st.session_state:
-    st.session_state.current_time = 0.0
-if 'current_temp' not in st.session_state:
-    st.session_state.current_temp = 20.0 
-if 'history_time' not in st.session_state:
-    st.session_state.history_time = [0.0]
-if 'history_temp' not in st.session_state:
-    st.session_state.history_temp = [20.0]
+# Trajectory holds the whole run (past + precomputed future); 'step' marks "now"
+# Row 0 = Time, Row 1 = Temperature; RUN_SLOTS columns
+if 'step' not in st.session_state:
+    st.session_state.step = 0
+if 'trajectory' not in st.session_state:
+    st.session_state.trajectory = np.empty((2, RUN_SLOTS), dtype=np.float32)
+    st.session_state.trajectory[:, 0] = (0.0, 20.0)
+if 'trajectory_key' not in st.session_state:
+    st.session_state.trajectory_key = None
+# Browser-side playback clock: (started_at, start_step, steps_per_second)
+if 'playback' not in st.session_state:
+    st.session_state.playback = None
 if 'selected_gas' not in st.session_state:
     st.session_state.selected_gas = "Nitrogen (N2)"
 
@@ -61,31 +87,50 @@ if 'insulation_noise' not in st.session_state:
     st.session_state.insulation_noise = random.uniform(0.98, 1.02)
 
 # Storage for saved runs (comparison lines)
+# saved_runs maps gas -> line color; saved_runs_df holds every saved point in long
+# format, so it is concatenated once per save instead of on every chart redraw
+def empty_runs_df():
+    return pd.DataFrame({
+        "Time": pd.Series(dtype=np.float32),
+        "Temperature": pd.Series(dtype=np.float32),
+        "Gas": pd.Series(dtype=object)
+    })
+
 if 'saved_runs' not in st.session_state:
     st.session_state.saved_runs = {}
+if 'saved_runs_df' not in st.session_state:
+    st.session_state.saved_runs_df = empty_runs_df()
 
 # Initialize Particle Data (Fixed positions)
+def new_particle_data(count=30):
+    """
+    Draws all particles in one batch: a dict of arrays, one entry per attribute.
+    """
+    rng = np.random.default_rng()
+    return {
+        'cx': rng.integers(10, 291, count),
+        'cy': rng.integers(10, 141, count),
+        'r': rng.integers(3, 7, count),
+        'dx': rng.choice([-5, 5], count),
+        'dy': rng.choice([-5, 5], count),
+        'delay': rng.random(count)
+    }
+
 if 'particle_data' not in st.session_state:
-    particles = []
-    for _ in range(30):
-        particles.append({
-            'cx': random.randint(10, 290),
-            'cy': random.randint(10, 140),
-            'r': random.randint(3, 6),
-            'dx': random.choice([-5, 5]),
-            'dy': random.choice([-5, 5]),
-            'delay': random.uniform(0, 1.0) 
-        })
-    st.session_state.particle_data = particles
+    st.session_state.particle_data = new_particle_data()
 
 # Physics Constants
 # Insulation: 1.0 = No Greenhouse Effect
 # We differentiate N2 and O2 slightly here
+class GasProps(NamedTuple):
+    insulation: float
+    color: str
+
 GAS_PROPERTIES = {
-    "Nitrogen (N2)":       {"Insulation": 1.0, "Color": "#1f77b4"}, 
-    "Oxygen (O2)":         {"Insulation": 1.02, "Color": "#2ca02c"}, # Slightly different from N2
-    "Carbon Dioxide (CO2)": {"Insulation": 4.0, "Color": "#ff7f0e"}, 
-    "Methane (CH4)":       {"Insulation": 8.0, "Color": "#d62728"}  
+    "Nitrogen (N2)":       GasProps(insulation=1.0, color="#1f77b4"), 
+    "Oxygen (O2)":         GasProps(insulation=1.02, color="#2ca02c"), # Slightly different from N2
+    "Carbon Dioxide (CO2)": GasProps(insulation=4.0, color="#ff7f0e"), 
+    "Methane (CH4)":       GasProps(insulation=8.0, color="#d62728")  
 }
 
 # Thermal Mass (Heat Capacity)
@@ -94,36 +139,87 @@ THERMAL_MASS = 8.0
 
 AMBIENT_TEMP = 20.0 
 
+# The browser player redraws this many times per second, showing whichever step
+# is due; faster simulation speeds advance several steps per redraw
+PLAYER_FPS = 10
+
+# Browser-side player clock
+def playback_rate(sim_speed):
+    """
+    Steps per second. Same pace as the old loop: one 0.1 minute step per
+    0.5 / sim_speed seconds.
+    """
+    return sim_speed / 0.5
+
+def sync_playback():
+    """
+    Moves 'step' to roughly where the browser animation is by now. The browser plays
+    the run on its own, so the position is estimated from the wall clock since Play.
+    """
+    if not st.session_state.is_running:
+        return
+    started_at, start_step, steps_per_second = st.session_state.playback
+    last_step = st.session_state.trajectory.shape[1] - 1
+    
+    # Same redraw rounding as the browser. The browser's clock only starts once the
+    # player iframe is built (a round trip and a render after Play), so this runs a
+    # little ahead of what it has drawn and Pause can land a step or two further on
+    redraws = math.floor((time.time() - started_at) * PLAYER_FPS)
+    steps_done = math.floor(redraws * steps_per_second / PLAYER_FPS)
+    step = min(start_step + steps_done, last_step)
+    st.session_state.step = step
+    st.session_state.playback = (started_at + redraws / PLAYER_FPS, step, steps_per_second)
+    
+    if step == last_step:
+        st.session_state.is_running = False
+
+# Catch up with the browser-side player before anything reads 'step'
+sync_playback()
+
 # --- 4. Sidebar Controls & Auto-Reset ---
 st.sidebar.header("🔬 Experiment Controls")
 
-gas_name = st.sidebar.selectbox("Select Gas Type", list(GAS_PROPERTIES.keys()))
-intensity = st.sidebar.slider("Light Intensity (Heating Power)", 1, 10, 5)
-concentration = st.sidebar.slider("Gas Concentration (ppm)", 0, 1000, 500)
-sim_speed = st.sidebar.slider("Simulation Speed", 1, 10, 5, help="Higher number = Faster animation")
+# Inside a form, dragging a slider no longer reruns the whole script on every
+# sample; changes are applied together when the user presses "Apply".
+with st.sidebar.form("controls"):
+    gas_name = st.selectbox("Select Gas Type", list(GAS_PROPERTIES.keys()))
+    intensity = st.slider("Light Intensity (Heating Power)", 1, 10, 5)
+    concentration = st.slider("Gas Concentration (ppm)", 0, 1000, 500)
+    sim_speed = st.slider("Simulation Speed", 1, 10, 5, help="Higher number = Faster animation")
+    st.form_submit_button("✅ Apply")
+
+# A new Simulation Speed takes over mid-run from where sync_playback() caught up
+if st.session_state.is_running:
+    started_at, start_step, _ = st.session_state.playback
+    st.session_state.playback = (started_at, start_step, playback_rate(sim_speed))
 
 # Button to clear comparison history
 if st.sidebar.button("🗑️ Clear Graph History"):
     st.session_state.saved_runs = {}
+    st.session_state.saved_runs_df = empty_runs_df()
     st.rerun()
 
 # Auto-Reset Logic: Check if gas changed
 if gas_name != st.session_state.selected_gas:
     # 1. Save the OLD run before switching, if it has data
-    if len(st.session_state.history_time) > 10: 
+    if st.session_state.step >= 10: 
         prev_gas = st.session_state.selected_gas
-        st.session_state.saved_runs[prev_gas] = {
-            "Time": st.session_state.history_time,
-            "Temp": st.session_state.history_temp,
-            "Color": GAS_PROPERTIES[prev_gas]["Color"]
-        }
+        n = st.session_state.step + 1
+        run_df = pd.DataFrame(st.session_state.trajectory[:, :n].T, columns=["Time", "Temperature"])
+        run_df["Gas"] = prev_gas
+        
+        # Replace any older run of the same gas
+        saved_df = st.session_state.saved_runs_df
+        st.session_state.saved_runs_df = pd.concat(
+            [saved_df[saved_df["Gas"] != prev_gas], run_df], ignore_index=True
+        )
+        st.session_state.saved_runs[prev_gas] = GAS_PROPERTIES[prev_gas].color
     
     # 2. Reset Everything for new gas
     st.session_state.is_running = False
-    st.session_state.current_time = 0.0
-    st.session_state.current_temp = AMBIENT_TEMP
-    st.session_state.history_time = [0.0]
-    st.session_state.history_temp = [AMBIENT_TEMP]
+    st.session_state.step = 0
+    st.session_state.trajectory[:, 0] = (0.0, AMBIENT_TEMP)
+    st.session_state.trajectory_key = None
     st.session_state.selected_gas = gas_name
     
     # 3. Generate NEW random variances for this run
@@ -131,36 +227,42 @@ if gas_name != st.session_state.selected_gas:
     st.session_state.insulation_noise = random.uniform(0.98, 1.02)
     
     # Regenerate particles
-    st.session_state.particle_data = [] 
-    for _ in range(30):
-        st.session_state.particle_data.append({
-            'cx': random.randint(10, 290),
-            'cy': random.randint(10, 140),
-            'r': random.randint(3, 6),
-            'dx': random.choice([-5, 5]),
-            'dy': random.choice([-5, 5]),
-            'delay': random.uniform(0, 1.0)
-        })
+    st.session_state.particle_data = new_particle_data()
     st.rerun()
 
-# --- 5. Helper Functions (Visuals) ---
+# --- 5. Helper Functions (Physics & Visuals) ---
 
-def generate_particle_html(temp, color):
-    speed_factor = max(0.0, min(1.0, (temp - 20) / 50.0)) 
-    duration = 1.0 - (speed_factor * 0.8) 
-    duration = max(0.1, duration) 
+def simulate(trajectory, step, heat_gain, cooling_rate, dt=TIME_STEP, ambient=AMBIENT_TEMP):
+    """
+    Fills trajectory[:, step + 1:] in place, starting from the temperature at 'step'.
+    dT/dt = (heat_gain - (T - ambient) * cooling_rate) / THERMAL_MASS has constant
+    coefficients, so T relaxes exponentially towards its steady state.
+    """
+    T_now = float(trajectory[1, step])
+    t_future = dt * np.arange(step + 1, trajectory.shape[1])
+    T_steady = ambient + heat_gain / cooling_rate
     
+    trajectory[0, step + 1:] = t_future
+    trajectory[1, step + 1:] = T_steady + (T_now - T_steady) * np.exp(-(cooling_rate / THERMAL_MASS) * (t_future - step * dt))
+    return trajectory
+
+
+@st.cache_data(max_entries=32)
+def generate_particle_html(color, particles):
+    """
+    Builds the particle box once per gas/particle set. The vibration speed is not
+    baked in; it follows the --vib CSS variable set by generate_vibration_style().
+    """
     particle_svgs = []
-    for p in st.session_state.particle_data:
-        cx, cy, r = p['cx'], p['cy'], p['r']
-        dx, dy, delay = p['dx'], p['dy'], p['delay']
+    for cx, cy, r, dx, dy, delay in zip(
+        particles['cx'], particles['cy'], particles['r'],
+        particles['dx'], particles['dy'], particles['delay']
+    ):
+        jiggle = "jiggle-" + ("p" if dx > 0 else "n") + ("p" if dy > 0 else "n")
         
         particle = (
-            f'<circle cx="{cx}" cy="{cy}" r="{r}" fill="{color}" opacity="0.7">'
-            f'<animateTransform attributeName="transform" type="translate" '
-            f'values="0,0; {dx},{dy}; 0,0" dur="{duration:.2f}s" '
-            f'begin="-{delay:.2f}s" repeatCount="indefinite" />'
-            f'</circle>'
+            f'<circle class="{jiggle}" cx="{cx}" cy="{cy}" r="{r}" fill="{color}" opacity="0.7" '
+            f'style="animation-delay: -{delay:.2f}s" />'
         )
         particle_svgs.append(particle)
     
@@ -176,192 +278,367 @@ def generate_particle_html(temp, color):
         f'</div>'
     )
 
-def plot_comparison_chart(history_t, history_T, current_gas_name, current_color):
+def vibration_period(temp):
+    """
+    Seconds per particle jiggle; hotter gas vibrates faster. Works on arrays too.
+    """
+    speed_factor = np.clip((temp - 20) / 50.0, 0.0, 1.0)
+    return np.maximum(0.1, 1.0 - (speed_factor * 0.8))
+
+def generate_vibration_style(temp):
+    """
+    Sets the particle vibration period through the --vib CSS variable. Bucketed to
+    whole degrees, like the browser player, so Play/Pause don't change the speed.
+    """
+    return f'<style>:root {{ --vib: {vibration_period(np.floor(temp)):.2f}s; }}</style>'
+
+def plot_comparison_chart(history, current_gas_name, current_color, interactive=True):
     """
     Builds a multi-line chart using Altair to show Current + Saved runs.
+    history is a (2, n) array view: row 0 = Time, row 1 = Temperature; pass None
+    when the browser player inserts the current run's rows itself. During playback
+    use interactive=False: zoom/pan and tooltips are only attached when paused.
     """
-    df_current = pd.DataFrame({
-        "Time": history_t,
-        "Temperature": history_T,
-        "Gas": current_gas_name
-    })
-    
-    all_dfs = [df_current]
-    
     domain = [current_gas_name]
     range_colors = [current_color]
     
-    for saved_gas_name, data in st.session_state.saved_runs.items():
+    for saved_gas_name, saved_color in st.session_state.saved_runs.items():
         if saved_gas_name != current_gas_name:
-            df_saved = pd.DataFrame({
-                "Time": data["Time"],
-                "Temperature": data["Temp"],
-                "Gas": saved_gas_name
-            })
-            all_dfs.append(df_saved)
             domain.append(saved_gas_name)
-            range_colors.append(data["Color"])
-            
-    final_df = pd.concat(all_dfs)
+            range_colors.append(saved_color)
     
+    final_df = st.session_state.saved_runs_df
+    if current_gas_name in st.session_state.saved_runs:
+        # The current gas is drawn live, so hide its older saved run
+        final_df = final_df[final_df["Gas"] != current_gas_name]
+    
+    if history is not None:
+        df_current = pd.DataFrame(history.T, columns=["Time", "Temperature"])
+        df_current["Gas"] = current_gas_name
+        final_df = pd.concat([final_df, df_current], ignore_index=True)
+    
+    # Types are explicit because the frame may be empty (nothing to infer them from)
     chart = alt.Chart(final_df).mark_line(strokeWidth=3).encode(
-        x=alt.X('Time', title='Time (minutes)'),
-        y=alt.Y('Temperature', title='Temperature (°C)', scale=alt.Scale(domain=[15, 65])),
-        color=alt.Color('Gas', scale=alt.Scale(domain=domain, range=range_colors), legend=alt.Legend(title="Gases")),
-        tooltip=['Gas', 'Time', 'Temperature']
+        x=alt.X('Time:Q', title='Time (minutes)'),
+        y=alt.Y('Temperature:Q', title='Temperature (°C)', scale=alt.Scale(domain=[15, 65])),
+        color=alt.Color('Gas:N', scale=alt.Scale(domain=domain, range=range_colors), legend=alt.Legend(title="Gases"))
     ).properties(
         height=350
-    ).interactive()
+    )
+    
+    if interactive:
+        chart = chart.encode(
+            tooltip=['Gas:N', alt.Tooltip('Time:Q', format='.1f'), alt.Tooltip('Temperature:Q', format='.2f')]
+        ).interactive()
     
     return chart
 
-def update_ui(temp, t, history_t, history_T, gas_props, gas_name):
+def update_ui(panel, temp, t, history, gas_props, gas_name):
     # 1. Update Meters
-    temp_placeholder.markdown(
-        f'<div class="metric-container"><div class="big-font">{temp:.1f} °C</div></div>', 
-        unsafe_allow_html=True
-    )
-    time_placeholder.markdown(
-        f'<div class="metric-container"><div class="big-font">{t:.1f} m</div></div>', 
-        unsafe_allow_html=True
-    )
+    panel["temp"].metric("Current Temperature", f"{temp:.1f} °C")
+    panel["time"].metric("Elapsed Time (min)", f"{t:.1f} m")
     
     # 2. Update Graph
-    chart = plot_comparison_chart(history_t, history_T, gas_name, gas_props["Color"])
-    chart_placeholder.altair_chart(chart, use_container_width=True)
+    chart = plot_comparison_chart(history, gas_name, gas_props.color)
+    panel["chart"].altair_chart(chart, use_container_width=True)
     
-    # 3. Update Particle Visual
-    particle_html = generate_particle_html(temp, gas_props["Color"])
-    particle_placeholder.markdown(particle_html, unsafe_allow_html=True)
+    # 3. Update Particle Speed (the particle SVG itself is built separately and cached)
+    panel["vib"].markdown(generate_vibration_style(temp), unsafe_allow_html=True)
+
+def generate_player_html(trajectory, step, steps_per_second, chart, final_chart, particle_html, gas_name):
+    """
+    Self-contained browser player for the rest of the run. The precomputed trajectory
+    is shipped once and requestAnimationFrame steps through it, so a whole run costs
+    one message to the browser instead of one per frame. Both charts should hold only
+    the saved runs: the current run goes in as columns and the player adds its rows.
+    chart is shown during playback, final_chart (interactive) once the run completes.
+    """
+    run_arrays = trajectory.astype(np.float64)
+    run = {
+        "time": np.round(run_arrays[0], 2).tolist(),
+        "temp": np.round(run_arrays[1], 2).tolist(),
+        "vib": np.round(vibration_period(np.floor(run_arrays[1])), 2).tolist(),
+        "gas": gas_name,
+        "start": step,
+        "stepsPerSecond": steps_per_second,
+        "fps": PLAYER_FPS,
+    }
+    spec = chart.properties(width="container").to_dict()
+    # Same saved-run data as spec, so the player reuses spec's datasets
+    final_spec = final_chart.properties(width="container").to_dict()
+    final_spec.pop("datasets", None)
+    
+    # The Vega scripts use Altair's version constants: vega-lite is an exact release,
+    # but vega and vega-embed are major versions only, so the CDN serves the newest
+    # release of that major
+    return f"""
+{style_block()}
+<style>
+    body {{ margin: 0; font-family: "Source Sans Pro", sans-serif; }}
+    .lab {{ display: flex; gap: 1rem; }}
+    .lab-left {{ flex: 1; }}
+    .lab-right {{ flex: 2; min-width: 0; }}
+    #chart {{ width: 100%; }}
+    .done {{ background-color: #dff0d8; color: #2b542c; padding: 12px; border-radius: 5px; }}
+    /* Same look as st.metric in the paused layout, so Play/Pause don't jump */
+    .metric-label {{ font-size: 0.875rem; min-height: 1.5rem; color: rgb(49, 51, 63); }}
+    .metric-value {{ font-size: 2.25rem; line-height: normal; color: rgb(49, 51, 63); padding-bottom: 0.25rem; }}
+</style>
+<div class="lab">
+    <div class="lab-left">
+        <div class="metric-label">Current Temperature</div>
+        <div class="metric-value" id="temp"></div>
+        <br>
+        <div class="metric-label">Elapsed Time (min)</div>
+        <div class="metric-value" id="time"></div>
+        <br>
+        {label_html("Particle View")}
+        {particle_html}
+    </div>
+    <div class="lab-right">
+        <div id="chart"></div>
+        <div id="done" class="done" hidden>Simulation Complete!</div>
+    </div>
+</div>
+<script>
+    const run = {json.dumps(run)};
+    const spec = {json.dumps(spec)};
+    const finalSpec = {json.dumps(final_spec)};
+    finalSpec.datasets = spec.datasets;
+    const last = run.temp.length - 1;
+    let shown = -1;    // last step drawn in the meters and particles
+    let charted = -1;  // last step inserted into the chart
+    let view = null;
+    let finished = false;
+
+    function show(i) {{
+        document.getElementById("temp").textContent = run.temp[i].toFixed(1) + " °C";
+        document.getElementById("time").textContent = run.time[i].toFixed(1) + " m";
+        document.documentElement.style.setProperty("--vib", run.vib[i] + "s");
+    }}
+
+    function chartUpTo(i) {{
+        // The chart catches up on its own once (and if) vega-embed has loaded
+        if (view === null || i <= charted) {{
+            return;
+        }}
+        const rows = [];
+        for (let j = charted + 1; j <= i; j++) {{
+            rows.push({{Time: run.time[j], Temperature: run.temp[j], Gas: run.gas}});
+        }}
+        view.insert(spec.data.name, rows).run();
+        charted = i;
+    }}
+
+    function showFinalChart() {{
+        // Playback is over: swap in the interactive chart (zoom/pan and tooltips)
+        vegaEmbed("#chart", finalSpec, {{actions: false}})
+            .then(result => {{
+                view = result.view;
+                charted = -1;
+                chartUpTo(last);
+            }})
+            .catch(chartUnavailable);
+    }}
+
+    function chartUnavailable() {{
+        document.getElementById("chart").textContent =
+            "Chart unavailable: the Vega scripts could not be loaded. Press Pause to see it.";
+    }}
+
+    function frame(now) {{
+        // performance.now() counts from when this iframe was created, shortly after
+        // Play. Redraw on a fixed 1 / fps clock, with the same rounding as sync_playback()
+        const redraws = Math.floor(now / 1000 * run.fps);
+        const i = Math.min(run.start + Math.floor(redraws * run.stepsPerSecond / run.fps), last);
+        if (i > shown) {{
+            show(i);
+            shown = i;
+            chartUpTo(i);
+        }}
+        if (shown < last) {{
+            requestAnimationFrame(frame);
+        }} else {{
+            document.getElementById("done").hidden = false;
+            finished = true;
+            if (view !== null) {{
+                showFinalChart();
+            }}
+        }}
+    }}
+
+    function embedChart() {{
+        // Called once the deferred Vega scripts below have loaded
+        if (typeof vegaEmbed !== "function") {{
+            chartUnavailable();
+            return;
+        }}
+        vegaEmbed("#chart", spec, {{actions: false}})
+            .then(result => {{
+                view = result.view;
+                chartUpTo(shown);
+                if (finished) {{
+                    showFinalChart();
+                }}
+            }})
+            .catch(chartUnavailable);
+    }}
+
+    // Meters and particles start now; a slow or unreachable CDN only delays the chart
+    show(run.start);
+    requestAnimationFrame(frame);
+</script>
+<script defer src="https://cdn.jsdelivr.net/npm/vega@{alt.VEGA_VERSION}" onerror="chartUnavailable()"></script>
+<script defer src="https://cdn.jsdelivr.net/npm/vega-lite@{alt.VEGALITE_VERSION}" onerror="chartUnavailable()"></script>
+<script defer src="https://cdn.jsdelivr.net/npm/vega-embed@{alt.VEGAEMBED_VERSION}" onload="embedChart()" onerror="chartUnavailable()"></script>
+"""
+
+@st.cache_resource
+def image_exists(path):
+    """
+    Checked once per server process instead of a stat() on every rerun.
+    """
+    return os.path.exists(path)
 
 # --- 6. Main UI Layout ---
 
 st.title("🧪 Interactive Greenhouse Effect Lab")
 
-# Top Row: Buttons
-col_btn1, col_btn2, col_btn3 = st.columns([1, 1, 4])
-with col_btn1:
-    if st.button("▶️ Play"):
-        st.session_state.is_running = True
-with col_btn2:
-    if st.button("II Pause"):
-        st.session_state.is_running = False
-with col_btn3:
-    if st.button("🔄 Reset"):
-        # Reset Logic is slightly duplicated here to ensure buttons work, 
-        # but we also generate new variance here.
-        st.session_state.is_running = False
-        st.session_state.current_time = 0.0
-        st.session_state.current_temp = AMBIENT_TEMP
-        st.session_state.history_time = [0.0]
-        st.session_state.history_temp = [AMBIENT_TEMP]
-        st.session_state.lamp_noise = random.uniform(0.95, 1.05)
-        st.session_state.insulation_noise = random.uniform(0.98, 1.02)
-        st.rerun()
-
-st.divider()
-
-# Middle Row: Layout
-col_left, col_right = st.columns([1, 2])
-
-with col_left:
-    st.markdown('<div class="label-font">Current Temperature</div>', unsafe_allow_html=True)
-    temp_placeholder = st.empty()
-    
-    st.write("") 
-    st.markdown('<div class="label-font">Elapsed Time (min)</div>', unsafe_allow_html=True)
-    time_placeholder = st.empty()
-    
-    st.write("")
-    st.markdown('<div class="label-font">Particle View</div>', unsafe_allow_html=True)
-    particle_placeholder = st.empty()
-
-with col_right:
-    chart_placeholder = st.empty()
+# Buttons, meters and chart live in the lab panel fragment (section 7)
+lab_container = st.container()
 
 # --- Image Upload / Display Section ---
 image_filename = "image_a015ba.jpg"
-if os.path.exists(image_filename):
+if image_exists(image_filename):
     st.write("") 
     st.image(image_filename, caption="Lab Setup", use_container_width=True)
 else:
     st.info(f"Note: To see the lab setup image, ensure '{image_filename}' is in the same folder as this script.")
 
-# --- 7. The Simulation Loop ---
+# --- 7. The Simulation ---
 
 # Physics Logic Setup
-base_cooling = 1.5 
-insulation_factor = 1.0 
+@st.cache_data
+def base_cooling_rate(gas_name, concentration):
+    """
+    Cooling rate before run noise. A pure function of the gas and concentration
+    sliders, so reruns with unchanged controls hit the cache.
+    """
+    base_cooling = 1.5 
+    insulation_factor = 1.0 
+    
+    props = GAS_PROPERTIES[gas_name]
+    
+    # Insulation Calculation:
+    if props.insulation > 2.0: # CO2 (4.0) and Methane (8.0)
+        # Significant Greenhouse Effect responding to concentration
+        added_insulation = (props.insulation - 1.0) * (concentration / 1000.0)
+        insulation_factor = 1.0 + added_insulation
+    else: 
+        # Nitrogen (1.0) and Oxygen (1.02)
+        # We apply a very TINY concentration factor just so the slider isn't "dead"
+        # This simulates minor density/mass effects but is negligible compared to CO2
+        base = props.insulation
+        added_insulation = 0.05 * (concentration / 1000.0) # Max effect is 0.05 vs CO2's 3.0
+        insulation_factor = base + added_insulation
+    
+    return base_cooling / insulation_factor
 
 props = GAS_PROPERTIES[gas_name]
 
-# Insulation Calculation:
-if props["Insulation"] > 2.0: # CO2 (4.0) and Methane (8.0)
-    # Significant Greenhouse Effect responding to concentration
-    added_insulation = (props["Insulation"] - 1.0) * (concentration / 1000.0)
-    insulation_factor = 1.0 + added_insulation
-else: 
-    # Nitrogen (1.0) and Oxygen (1.02)
-    # We apply a very TINY concentration factor just so the slider isn't "dead"
-    # This simulates minor density/mass effects but is negligible compared to CO2
-    base = props["Insulation"]
-    added_insulation = 0.05 * (concentration / 1000.0) # Max effect is 0.05 vs CO2's 3.0
-    insulation_factor = base + added_insulation
-
 # Apply Random "Bottle" Noise (simulates sensor/material variance per run)
-insulation_factor *= st.session_state.insulation_noise
+cooling_rate = base_cooling_rate(gas_name, concentration) / st.session_state.insulation_noise
+
+# Physics Step with Smoothing & Random Variance
+# 1. Apply Random "Lamp" Noise to Heat Gain
+heat_gain = (intensity * 1.5) * st.session_state.lamp_noise
+
+# 2. Precompute the rest of the run in one shot
+# The trajectory is only rebuilt (from "now" onwards, the past is kept as history)
+# when the sliders change, so Pause/Play just resumes it.
+trajectory_key = (heat_gain, cooling_rate)
+if st.session_state.trajectory_key != trajectory_key:
+    simulate(st.session_state.trajectory, st.session_state.step, heat_gain, cooling_rate)
+    st.session_state.trajectory_key = trajectory_key
+
+# 3. Animate the Lab Panel
+@st.fragment
+def lab_panel(props, gas_name, sim_speed):
+    """
+    Buttons, meters, chart and playback. Running as a fragment means Play/Pause
+    only rerun this panel, not the sidebar, styles and image.
+    """
+    # Top Row: Buttons
+    col_btn1, col_btn2, col_btn3 = st.columns([1, 1, 4])
+    with col_btn1:
+        if st.button("▶️ Play"):
+            sync_playback()
+            st.session_state.is_running = True
+            st.session_state.playback = (time.time(), st.session_state.step, playback_rate(sim_speed))
+    with col_btn2:
+        if st.button("II Pause"):
+            sync_playback()
+            st.session_state.is_running = False
+    with col_btn3:
+        if st.button("🔄 Reset"):
+            # Reset Logic is slightly duplicated here to ensure buttons work, 
+            # but we also generate new variance here.
+            st.session_state.is_running = False
+            st.session_state.step = 0
+            st.session_state.trajectory[:, 0] = (0.0, AMBIENT_TEMP)
+            st.session_state.trajectory_key = None
+            st.session_state.lamp_noise = random.uniform(0.95, 1.05)
+            st.session_state.insulation_noise = random.uniform(0.98, 1.02)
+            st.rerun()
+
+    st.divider()
+
+    trajectory = st.session_state.trajectory
+    last_step = trajectory.shape[1] - 1
+    step = st.session_state.step
+    particle_html = generate_particle_html(props.color, st.session_state.particle_data)
+
+    if st.session_state.is_running:
+        # Physics is already done: hand the rest of the trajectory to the browser
+        # player and return, instead of holding this thread in a sleep loop
+        chart = plot_comparison_chart(None, gas_name, props.color, interactive=False)
+        final_chart = plot_comparison_chart(None, gas_name, props.color)
+        _, _, steps_per_second = st.session_state.playback
+        player_html = generate_player_html(
+            trajectory, step, steps_per_second, chart, final_chart, particle_html, gas_name
+        )
+        st.iframe(player_html, height=520)
+        return
 
-cooling_rate = base_cooling / insulation_factor
+    # Middle Row: Layout
+    col_left, col_right = st.columns([1, 2])
 
-# Render initial state
-update_ui(
-    st.session_state.current_temp, 
-    st.session_state.current_time, 
-    st.session_state.history_time, 
-    st.session_state.history_temp,
-    props,
-    gas_name
-)
+    with col_left:
+        temp_placeholder = st.empty()
+    
+        st.write("") 
+        time_placeholder = st.empty()
+    
+        st.write("")
+        st.markdown(label_html("Particle View"), unsafe_allow_html=True)
+        particle_placeholder = st.empty()
+        vib_placeholder = st.empty()
+
+    with col_right:
+        chart_placeholder = st.empty()
+
+    panel = {
+        "temp": temp_placeholder,
+        "time": time_placeholder,
+        "chart": chart_placeholder,
+        "vib": vib_placeholder,
+    }
 
-if st.session_state.is_running:
-    while st.session_state.is_running and st.session_state.current_time < 20.0:
-        
-        dt = 0.1 
-        
-        # Physics Step with Smoothing & Random Variance
-        # 1. Apply Random "Lamp" Noise to Heat Gain
-        heat_gain = (intensity * 1.5) * st.session_state.lamp_noise
-        
-        # 2. Calculate Heat Loss
-        temp_diff = st.session_state.current_temp - AMBIENT_TEMP
-        heat_loss = temp_diff * cooling_rate
-        
-        # 3. Calculate Net Change divided by THERMAL MASS
-        # This slows down the rate of change, creating a curved "ramp up"
-        net_change = ((heat_gain - heat_loss) / THERMAL_MASS) * dt
-        
-        st.session_state.current_temp += net_change
-        st.session_state.current_time += dt
-        
-        if st.session_state.current_temp < AMBIENT_TEMP:
-             st.session_state.current_temp = AMBIENT_TEMP
-        
-        st.session_state.history_time.append(st.session_state.current_time)
-        st.session_state.history_temp.append(st.session_state.current_temp)
-        
-        # 2. Update UI
-        update_ui(
-            st.session_state.current_temp, 
-            st.session_state.current_time, 
-            st.session_state.history_time, 
-            st.session_state.history_temp,
-            props,
-            gas_name
-        )
-        
-        # 3. Speed Control
-        time.sleep(0.5 / sim_speed)
-        
-    if st.session_state.current_time >= 20.0:
-        st.session_state.is_running = False
+    particle_placeholder.markdown(particle_html, unsafe_allow_html=True)
+    update_ui(panel, trajectory[1, step], trajectory[0, step], trajectory[:, :step + 1], props, gas_name)
+
+    if step == last_step:
         st.success("Simulation Complete!")
+
+with lab_container:
+    lab_panel(props, gas_name, sim_speed)